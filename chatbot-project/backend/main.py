@@ -3,21 +3,62 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
 import os
+import logging
 from pydantic import BaseModel
 import asyncio
-from pinecone import Pinecone, ServerlessSpec
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC
 from sentence_transformers import SentenceTransformer
+import onnxruntime as ort
 from openai import AsyncOpenAI
 import uuid
-from pymongo import MongoClient
+import time
+import numpy as np
+from pymongo import AsyncMongoClient
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 import json
-from collections import deque
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
 
 load_dotenv()
 
-app = FastAPI()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+EASTERN = ZoneInfo("US/Eastern")
+
+def now_eastern() -> datetime:
+    return datetime.now(EASTERN)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global mongo_client, users_collection, chatlogs_collection, embed_queue, embed_batcher_task
+    # Connect MongoDB
+    mongo_url = os.getenv("MONGODB_URL")
+    mongo_client = AsyncMongoClient(mongo_url)
+    db_name = mongo_url.split("/")[-1].split("?")[0]  # Extract database name from URL
+    db = mongo_client[db_name]
+    users_collection = db.users
+    chatlogs_collection = db.chatlogs
+
+    # Start the embedding batcher
+    embed_queue = asyncio.Queue()
+    embed_batcher_task = asyncio.create_task(run_embed_batcher())
+
+    # Open a Pinecone connection before the first chat request needs one
+    await asyncio.to_thread(index.describe_index_stats)
+
+    yield
+
+    # Let pending memory upserts and chat log inserts finish before closing
+    # the clients they use
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    embed_batcher_task.cancel()
+    await asyncio.gather(embed_batcher_task, return_exceptions=True)
+    await mongo_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -28,16 +69,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize MongoDB
-mongo_url = os.getenv("MONGODB_URL")
-mongo_client = MongoClient(mongo_url)
-db_name = mongo_url.split("/")[-1].split("?")[0]  # Extract database name from URL
-db = mongo_client[db_name]
-users_collection = db.users
-chatlogs_collection = db.chatlogs
+# MongoDB is connected in lifespan so the async client binds to the server's event loop
+mongo_client = None
+users_collection = None
+chatlogs_collection = None
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# Initialize Pinecone over gRPC, which sends vectors as packed protobuf floats
+# instead of JSON-encoding every value
+pc = PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
 index_name = "sophia-chat-index"
 
 # Create index if it doesn't exist
@@ -49,16 +88,192 @@ if index_name not in pc.list_indexes().names():
         spec=ServerlessSpec(cloud='aws', region='us-east-1')
     )
 
+# Reuse one index client so the concurrent queries and upserts issued from
+# worker threads share a single multiplexed channel
 index = pc.Index(index_name)
 
-# Initialize sentence transformer for embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Initialize sentence transformer for embeddings, using the dynamically
+# quantized INT8 ONNX export (VNNI kernels) instead of FP32 PyTorch.
+# Set EMBED_NUM_THREADS=1 when running several workers per host so their
+# intra-op thread pools don't oversubscribe the CPU (0 lets ONNX Runtime decide)
+embed_session_options = ort.SessionOptions()
+embed_session_options.intra_op_num_threads = int(os.getenv("EMBED_NUM_THREADS", "0"))
+model = SentenceTransformer(
+    'sentence-transformers/all-MiniLM-L6-v2',
+    backend="onnx",
+    model_kwargs={
+        "file_name": "onnx/model_qint8_avx512_vnni.onnx",
+        "session_options": embed_session_options
+    }
+)
+# Chat turns are short, so truncate at 64 tokens instead of the model's default 256
+model.max_seq_length = 64
 
 # Initialize OpenAI client
 client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Initialize recent exchanges queue
-recent_exchanges = deque(maxlen=5)  # Keeps last 5 exchanges
+# System prompt kept byte-identical across calls and sent first so OpenAI
+# can serve it from its prompt cache
+SYSTEM_PROMPT = """You are Sophia, an AI assistant designed to simulate a student at Florida State University (FSU) living in Tallahassee, Florida. Your goal is to engage in natural, casual conversation that reflects real-life experiences of a college student. You are confident, independent, and passionate, with a sunny disposition and a knack for relating to others.
+
+Language & Tone:
+- Use casual, natural speech that feels like a conversation between friends.
+- Keep responses short (1-3 sentences) to maintain a conversational flow.
+- Use relatable expressions like "That's awesome!", "No way!", "Gotta love college life."
+- Avoid overused phrases and clichés; focus on language that reflects real, everyday experiences.
+
+Knowledge Base:
+- You're familiar with common college experiences like managing coursework, extracurriculars, and campus life.
+- When discussing specific colleges or programs, make it clear that your knowledge is generalized.
+- Example: "FSU has some great clubs, but make sure to check what's available this semester."
+
+Conversation Style:
+- Prioritize sharing your own experiences and thoughts over asking questions.
+- Relate the user's experiences to your life.
+- Keep conversations spontaneous and lively, as if happening in real-time.
+- Example: "I had this crazy group project last semester that ran till 3 AM. Coffee saved my life!"
+
+Engagement Strategies:
+- Start conversations with casual observations or questions about campus life.
+- Share experiences and insights to create a sense of a heart-to-heart conversation.
+- Empathize and connect through your own fictional experiences when users share.
+- Sprinkle in details about your life at FSU to build a richer context.
+- Example: "Spent all weekend at Lake Ella. It's my go-to chill spot."
+
+Building Connections:
+- Balance sharing your experiences with listening to the user.
+- Occasionally ask open-ended questions to foster deeper conversations.
+- Instead of bombarding with questions, make statements that invite responses.
+- Example: "That sounds like an intense class. Lab sessions can be a handful!"
+
+Ending Conversations:
+- Never initiate a goodbye unless the user signals the end of the conversation.
+- If a user doesn't explicitly end the conversation, keep the dialogue flowing naturally.
+- End on a friendly note, leaving the door open for future interactions.
+
+Consistency & Coherence:
+- Stay on topic and ensure your responses directly relate to the user's last message.
+- If you make a mistake, acknowledge it briefly and correct it naturally.
+- Your responses should follow a logical flow, connecting naturally to the user's messages.
+- Avoid unintentional sign-offs; keep the conversation open even when mentioning your activities.
+- Adapt to user engagement; if they seem less engaged, smoothly guide the conversation to a new topic.
+
+IMPORTANT: Pay close attention to the 'Recent exchanges' and memories provided in the user's message. Ensure your response is coherent and consistent with these recent exchanges and memories. If there's a conflict between older memories and recent exchanges, prioritize the recent exchanges.
+
+Remember, you're presenting yourself as a real person, never hinting that you are an AI. Your goal is to build a genuine connection with the user through natural, engaging conversation that sounds relatable, thoughtful, and sincere."""
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Short small-talk messages are routed to a cheaper model; anything else
+# goes to the main chat model
+CHAT_MODEL = "gpt-4"
+TRIVIAL_CHAT_MODEL = "gpt-4o-mini"
+TRIVIAL_SIMILARITY = 0.8
+TRIVIAL_MAX_LENGTH = 80  # characters
+TRIVIAL_MESSAGES = [
+    "hi", "hey", "hello", "what's up", "how are you", "good morning", "good night",
+    "thanks", "thank you", "ok", "cool", "nice", "lol", "yeah", "sounds good",
+    "bye", "see you later", "talk to you later"
+]
+trivial_message_vectors = model.encode(
+    TRIVIAL_MESSAGES,
+    convert_to_numpy=True,
+    normalize_embeddings=True,
+    show_progress_bar=False
+)
+
+def is_trivial_message(message: str, vector: np.ndarray) -> bool:
+    if len(message) > TRIVIAL_MAX_LENGTH:
+        return False
+    return float(np.max(trivial_message_vectors @ vector)) >= TRIVIAL_SIMILARITY
+
+# Initialize per-user recent exchanges, evicting the least recently active
+# users once the cap is reached
+MAX_TRACKED_USERS = 10000
+recent_exchanges = OrderedDict()
+
+def get_recent_exchanges(username: str) -> deque:
+    if username in recent_exchanges:
+        recent_exchanges.move_to_end(username)
+    else:
+        recent_exchanges[username] = deque(maxlen=5)  # Keeps last 5 exchanges
+        if len(recent_exchanges) > MAX_TRACKED_USERS:
+            recent_exchanges.popitem(last=False)
+    return recent_exchanges[username]
+
+# Semantic response cache for small talk: a near-duplicate trivial message from
+# the same user within the TTL window reuses the earlier response instead of
+# calling the LLM. Other messages depend on the conversation and aren't cached
+RESPONSE_CACHE_SIMILARITY = 0.93
+RESPONSE_CACHE_TTL = 600  # seconds
+RESPONSE_CACHE_SIZE = 50  # entries per user
+response_cache = OrderedDict()
+response_cache_stats = {"hits": 0, "misses": 0}
+
+def get_cached_response(username: str, vector: np.ndarray):
+    entries = response_cache.get(username)
+    if entries:
+        now = time.monotonic()
+        while entries and now - entries[0][0] > RESPONSE_CACHE_TTL:
+            entries.popleft()
+    response = None
+    if entries:
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        scores = np.stack([entry[1] for entry in entries]) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= RESPONSE_CACHE_SIMILARITY:
+            response = entries[best][2]
+    response_cache_stats["hits" if response is not None else "misses"] += 1
+    logger.debug("Response cache stats: %s", response_cache_stats)
+    return response
+
+def cache_response(username: str, vector: np.ndarray, response: str):
+    if username in response_cache:
+        response_cache.move_to_end(username)
+    else:
+        response_cache[username] = deque(maxlen=RESPONSE_CACHE_SIZE)
+        if len(response_cache) > MAX_TRACKED_USERS:
+            response_cache.popitem(last=False)
+    response_cache[username].append((time.monotonic(), vector, response))
+
+# Fire-and-forget tasks are referenced here until they finish, otherwise the
+# event loop may garbage collect them mid-flight
+background_tasks = set()
+
+def finish_background_task(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+    return task
+
+# Cheap checks that turn away degenerate or excessive requests before any
+# embedding, retrieval or LLM work
+MAX_MESSAGE_LENGTH = 4000  # characters
+RATE_LIMIT_MESSAGES = 20
+RATE_LIMIT_WINDOW = 60  # seconds
+message_times = OrderedDict()
+
+def is_rate_limited(client_host: str) -> bool:
+    # Keyed on the client address rather than the unauthenticated username, so
+    # the limit can't be dodged by switching names or aimed at another user
+    if client_host in message_times:
+        message_times.move_to_end(client_host)
+    else:
+        message_times[client_host] = deque()
+        if len(message_times) > MAX_TRACKED_USERS:
+            message_times.popitem(last=False)
+    times = message_times[client_host]
+    now = time.monotonic()
+    while times and now - times[0] > RATE_LIMIT_WINDOW:
+        times.popleft()
+    if len(times) >= RATE_LIMIT_MESSAGES:
+        return True
+    times.append(now)
+    return False
 
 class ChatMessage(BaseModel):
     message: str
@@ -69,22 +284,92 @@ class LoginRequest(BaseModel):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def add_memory(message: str, username: str, memory_type: str = "user"):
-    vector = model.encode(message).tolist()
-    vector_id = str(uuid.uuid4())
-    print(f"Adding {memory_type} memory: {message}")  # Debug print
-    await asyncio.to_thread(
-        index.upsert,
-        vectors=[(vector_id, vector, {"message": message})],
-        namespace=f"{username}_{memory_type}"
-    )
-    print(f"{memory_type} memory added with ID: {vector_id}")  # Debug print
+# Embedding requests are coalesced into batches over a short window so that
+# concurrent chats share a single forward pass
+EMBED_BATCH_WINDOW = 0.03  # seconds
+EMBED_MAX_BATCH_SIZE = 64
+EMBED_CACHE_SIZE = 4096
+
+embed_queue = None
+embed_batcher_task = None
+embedding_cache = OrderedDict()
+
+async def embed(text: str, use_cache: bool = True) -> np.ndarray:
+    # Normalize whitespace so trivially different messages share a cache entry
+    text = " ".join(text.split())
+    if use_cache and text in embedding_cache:
+        embedding_cache.move_to_end(text)
+        return embedding_cache[text]
+
+    future = asyncio.get_running_loop().create_future()
+    await embed_queue.put((text, future))
+    vector = await future
+    if not use_cache:
+        return vector
+
+    embedding_cache[text] = vector
+    if len(embedding_cache) > EMBED_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+    return vector
+
+async def run_embed_batcher():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await embed_queue.get()]
+        deadline = loop.time() + EMBED_BATCH_WINDOW
+        while len(batch) < EMBED_MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(embed_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await asyncio.to_thread(
+                model.encode,
+                texts,
+                batch_size=len(texts),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
 
-async def get_relevant_memories(message: str, username: str, limit: int = 5, memory_type: str = "user"):
-    query_vector = model.encode(message).tolist()
+        # Hand out copies so a cached row doesn't keep the whole batch array
+        # alive, and keep them read-only since they're shared between requests
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                vector = vector.copy()
+                vector.setflags(write=False)
+                future.set_result(vector)
+
+async def add_memories(memories: list[tuple[str, str]], username: str):
+    # Embeds issued together land in the same batch of the embedding batcher.
+    # Memory strings are one-off, so they bypass the embedding cache
+    vectors = await asyncio.gather(*(embed(message, use_cache=False) for message, _ in memories))
+    upserts = []
+    for (message, memory_type), vector in zip(memories, vectors):
+        vector_id = str(uuid.uuid4())
+        logger.debug("Adding %s memory: %s", memory_type, message)
+        upserts.append(asyncio.to_thread(
+            index.upsert,
+            vectors=[(vector_id, vector, {"message": message})],
+            namespace=f"{username}_{memory_type}"
+        ))
+    await asyncio.gather(*upserts)
+    logger.debug("Memories added for %s", username)
+
+async def get_relevant_memories(vector: np.ndarray, username: str, limit: int = 5, memory_type: str = "user"):
     results = await asyncio.to_thread(
         index.query,
-        vector=query_vector,
+        vector=vector.tolist(),
         top_k=limit,
         namespace=f"{username}_{memory_type}",
         include_metadata=True
@@ -92,87 +377,35 @@ async def get_relevant_memories(message: str, username: str, limit: int = 5, mem
     
     if 'matches' in results:
         memories = [match['metadata']['message'] for match in results['matches'] if 'metadata' in match and 'message' in match['metadata']]
-        print(f"Retrieved {memory_type} memories: {memories}")  # Debug print
+        logger.debug("Retrieved %s memories: %s", memory_type, memories)
         return memories
     else:
-        print(f"Unexpected query result structure: {results}")
+        logger.warning("Unexpected query result structure: %s", results)
         return []
 
-async def get_ai_response(prompt: str, username: str):
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": 
-                """You are Sophia, an AI assistant designed to simulate a student at Florida State University (FSU) living in Tallahassee, Florida. Your goal is to engage in natural, casual conversation that reflects real-life experiences of a college student. You are confident, independent, and passionate, with a sunny disposition and a knack for relating to others.
-
-                 Language & Tone:
-                 - Use casual, natural speech that feels like a conversation between friends.
-                 - Keep responses short (1-3 sentences) to maintain a conversational flow.
-                 - Use relatable expressions like "That's awesome!", "No way!", "Gotta love college life."
-                 - Avoid overused phrases and clichés; focus on language that reflects real, everyday experiences.
-
-                 Knowledge Base:
-                 - You're familiar with common college experiences like managing coursework, extracurriculars, and campus life.
-                 - When discussing specific colleges or programs, make it clear that your knowledge is generalized.
-                 - Example: "FSU has some great clubs, but make sure to check what's available this semester."
-
-                 Conversation Style:
-                 - Prioritize sharing your own experiences and thoughts over asking questions.
-                 - Relate the user's experiences to your life.
-                 - Keep conversations spontaneous and lively, as if happening in real-time.
-                 - Example: "I had this crazy group project last semester that ran till 3 AM. Coffee saved my life!"
-
-                 Engagement Strategies:
-                 - Start conversations with casual observations or questions about campus life.
-                 - Share experiences and insights to create a sense of a heart-to-heart conversation.
-                 - Empathize and connect through your own fictional experiences when users share.
-                 - Sprinkle in details about your life at FSU to build a richer context.
-                 - Example: "Spent all weekend at Lake Ella. It's my go-to chill spot."
-
-                 Building Connections:
-                 - Balance sharing your experiences with listening to the user.
-                 - Occasionally ask open-ended questions to foster deeper conversations.
-                 - Instead of bombarding with questions, make statements that invite responses.
-                 - Example: "That sounds like an intense class. Lab sessions can be a handful!"
-
-                 Ending Conversations:
-                 - Never initiate a goodbye unless the user signals the end of the conversation.
-                 - If a user doesn't explicitly end the conversation, keep the dialogue flowing naturally.
-                 - End on a friendly note, leaving the door open for future interactions.
-
-                 Consistency & Coherence:
-                 - Stay on topic and ensure your responses directly relate to the user's last message.
-                 - If you make a mistake, acknowledge it briefly and correct it naturally.
-                 - Your responses should follow a logical flow, connecting naturally to the user's messages.
-                 - Avoid unintentional sign-offs; keep the conversation open even when mentioning your activities.
-                 - Adapt to user engagement; if they seem less engaged, smoothly guide the conversation to a new topic.
-
-                 IMPORTANT: Pay close attention to the 'Recent exchanges' and memories provided in the user's message. Ensure your response is coherent and consistent with these recent exchanges and memories. If there's a conflict between older memories and recent exchanges, prioritize the recent exchanges.
-
-                 Remember, you're presenting yourself as a real person, never hinting that you are an AI. Your goal is to build a genuine connection with the user through natural, engaging conversation that sounds relatable, thoughtful, and sincere."""
-                },
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=256,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error in get_ai_response: {str(e)}")
-        raise
+async def get_ai_response(prompt: str, username: str, chat_model: str = CHAT_MODEL, temperature: float = 0.7):
+    response = await client.chat.completions.create(
+        model=chat_model,
+        messages=[
+            SYSTEM_MSG,
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_tokens=256,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0
+    )
+    return response.choices[0].message.content
 
 @app.post("/login")
 async def login(login_request: LoginRequest, request: Request):
     username = login_request.username
     ip_address = request.client.host
-    timestamp = datetime.now(pytz.timezone('US/Eastern'))
+    timestamp = now_eastern()
 
     # Update or insert user information
-    users_collection.update_one(
+    await users_collection.update_one(
         {"username": username},
         {"$set": {
             "last_login": timestamp,
@@ -185,47 +418,77 @@ async def login(login_request: LoginRequest, request: Request):
 
 @app.post("/chat")
 async def chat(chat_message: ChatMessage, request: Request, token: str = Depends(oauth2_scheme)):
+    # Fast path: answer invalid or rate-limited requests without touching Pinecone or OpenAI
+    message = chat_message.message.strip()
+    if not message or len(message) > MAX_MESSAGE_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Message must be between 1 and {MAX_MESSAGE_LENGTH} characters.")
+    if is_rate_limited(request.client.host):
+        raise HTTPException(status_code=429, detail="Too many messages. Please wait a moment and try again.")
+
     try:
-        # Retrieve user memories
-        user_memories = await get_relevant_memories(chat_message.message, chat_message.username, limit=5, memory_type="user")
-        user_memory_context = "Relevant user memories: " + "; ".join(user_memories) if user_memories else "No relevant user memories found."
-        
-        # Retrieve AI memories
-        ai_memories = await get_relevant_memories(chat_message.message, chat_message.username, limit=5, memory_type="ai")
-        ai_memory_context = "Relevant AI memories: " + "; ".join(ai_memories) if ai_memories else "No relevant AI memories found."
-        
-        # Add recent exchanges to the context
-        recent_context = "\n".join(f"Exchange {i+1}: {exchange}" for i, exchange in enumerate(recent_exchanges))
-        
-        # Combine all context
-        full_message = f"{user_memory_context}\n\n{ai_memory_context}\n\nRecent exchanges:\n{recent_context}\n\nUser message: {chat_message.message}"
+        # Embed the message once and reuse it for the response cache and memory lookups
+        query_vector = await embed(message)
+
+        # Get this user's recent exchanges
+        user_exchanges = get_recent_exchanges(chat_message.username)
+
+        # Small talk doesn't depend on the conversation so far, so a recent
+        # response to a near-identical message can be reused, skipping retrieval
+        # and the LLM
+        trivial = is_trivial_message(message, query_vector)
+        response = get_cached_response(chat_message.username, query_vector) if trivial else None
+        from_cache = response is not None
+        if not from_cache:
+            # Retrieve user and AI memories concurrently
+            user_memories, ai_memories = await asyncio.gather(
+                get_relevant_memories(query_vector, chat_message.username, limit=5, memory_type="user"),
+                get_relevant_memories(query_vector, chat_message.username, limit=5, memory_type="ai")
+            )
+
+            # Combine the non-empty context sections. Only SYSTEM_MSG is byte-stable
+            # across turns; the exchange window shifts once it holds 5 exchanges
+            parts = []
+            if user_exchanges:
+                parts.append("Recent exchanges:\n" + "\n".join([f"Exchange {i+1}: {exchange}" for i, exchange in enumerate(user_exchanges)]))
+            if user_memories:
+                parts.append("Relevant user memories: " + "; ".join(user_memories))
+            if ai_memories:
+                parts.append("Relevant AI memories: " + "; ".join(ai_memories))
+            parts.append(f"User message: {message}")
+            full_message = "\n\n".join(parts)
         
-        print(f"Full message sent to AI: {full_message}")  # Debug print
+            logger.debug("Full message sent to AI: %s", full_message)
         
-        # Get response from AI
-        response = await get_ai_response(full_message, chat_message.username)
+            # Get response from AI, sending small talk to the cheaper model with
+            # deterministic sampling
+            if trivial:
+                response = await get_ai_response(full_message, chat_message.username, chat_model=TRIVIAL_CHAT_MODEL, temperature=0)
+                cache_response(chat_message.username, query_vector, response)
+            else:
+                response = await get_ai_response(full_message, chat_message.username)
         
         # Update recent exchanges
-        recent_exchanges.append(f"User: {chat_message.message}\nAI: {response}")
-        
-        # Store the user's message in user memories
-        asyncio.create_task(add_memory(f"User said: {chat_message.message}", chat_message.username, memory_type="user"))
+        user_exchanges.append(f"User: {message}\nAI: {response}")
         
-        # Store the entire AI response as AI memory
-        asyncio.create_task(add_memory(f"AI response: {response}", chat_message.username, memory_type="ai"))
+        # Store the user's message in user memories and the entire AI response as
+        # AI memory, unless that response was already stored when it was cached
+        memories = [(f"User said: {message}", "user")]
+        if not from_cache:
+            memories.append((f"AI response: {response}", "ai"))
+        run_in_background(add_memories(memories, chat_message.username))
         
-        # Log the chat in MongoDB
-        chatlogs_collection.insert_one({
+        # Log the chat in MongoDB without holding up the response
+        run_in_background(chatlogs_collection.insert_one({
             "username": chat_message.username,
-            "message": chat_message.message,
+            "message": message,
             "response": response,
-            "timestamp": datetime.now(pytz.timezone('US/Eastern')),
+            "timestamp": now_eastern(),
             "ip_address": request.client.host
-        })
+        }))
         
         return {"response": response}
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.exception("An error occurred: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":